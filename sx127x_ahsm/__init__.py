@@ -1,4 +1,4 @@
 from .phy_gpio_ahsm import GpioAhsm
-from .phy_sx127x_ahsm import SX127xSpiAhsm
+from .phy_sx127x_ahsm import SX127xSpiAhsm, PhyRxCmd, PhyTxCmd
 
 from . import mock_gpio
\ No newline at end of file
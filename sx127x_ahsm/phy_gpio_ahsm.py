@@ -10,6 +10,10 @@ NOTE: Uses GPIO.BCM pin numbering.
 """
 
 
+import collections
+import os
+import sys
+
 import farc
 
 try:
@@ -17,26 +21,165 @@ try:
 except:
     from . import mock_gpio as GPIO
 
+# gpiod (libgpiod) delivers kernel edge events through a file
+# descriptor, letting the event loop read pin edges directly
+# without RPi.GPIO's callback thread
+try:
+    import gpiod
+except:
+    gpiod = None
+
+
+# The GPIO character device holding the RasPi header pins
+GPIOD_CHIP = "gpiochip0"
+
+# libgpiod v2 replaced the Chip/get_line request API
+# with request_lines(); detect which bindings are installed
+_GPIOD_V2 = gpiod is not None and hasattr(gpiod, "request_lines")
+
+
+# Bound method for the event loop's clock, saving the
+# farc.Framework._event_loop.time attribute walk on every pin edge
+_loop_time = farc.Framework._event_loop.time
+
+# Number of events preallocated per registered signal
+EVT_POOL_DEPTH = 8
+
+# Pools of reusable events, keyed by signal number.
+# Preallocating the events keeps the GPIO handler
+# from creating garbage on every pin edge.
+_evt_pools = {}
+
+
+class _PooledEvent(object):
+    """A reusable stand-in for farc.Event.
+    Pin-edge events are published at interrupt rate,
+    so they are drawn from a preallocated pool
+    instead of being created on every edge.
+    """
+    __slots__ = ("signal", "value")
+
+    def __init__(self, signal, value=None):
+        self.signal = signal
+        self.value = value
+
+
+def release_evt(evt):
+    """Returns a pooled pin-edge event to its pool.
+    The subscriber should call this after it has consumed the event.
+    Events that did not come from a pool are ignored.
+    """
+    if type(evt) is _PooledEvent:
+        pool = _evt_pools.get(evt.signal)
+        if pool is not None:
+            pool.append(evt)
+
+
+# Size of the pin-edge ring buffer (must be a power of two)
+RING_SIZE = 64
+
+# Single-producer/single-consumer ring buffer of (signal, time) pairs.
+# The RPi.GPIO thread is the only producer; the event loop is the
+# only consumer.  The indices only ever grow (they are masked on use),
+# so no lock is needed: the producer writes the slot before advancing
+# _ring_tail and the consumer only reads slots behind _ring_tail.
+_ring = [None] * RING_SIZE
+_ring_head = 0 # consumer index
+_ring_tail = 0 # producer index
+
+# Pipe used to wake the event loop after an edge is enqueued
+_wake_rd = None
+_wake_wr = None
+
 
 # The RPi.GPIO module responds to external I/O in a separate thread.
 # State machine processing should not happen in that thread.
-# So in the following GPIO handler, we publish a unique event for each GPIO.
-# The separate thread will publish the event and exit quickly
-# back to the main thread; the event will be processed there.
-def _gpio_input_handler(sig):
-    """Emits the given signal upon a pin change.
-    The event's value is the current time.
+# So in the following GPIO handler, we enqueue the edge on a
+# lock-free ring buffer and wake the event loop via a pipe.
+# The separate thread exits quickly back to the main thread;
+# the event loop drains the ring and publishes the events there.
+def _gpio_input_handler(sig, pin_idx):
+    """Records the given signal, pin index and the current time
+    on the ring buffer and wakes the event loop
+    so it publishes the event.
+    If the ring is full the edge is dropped.
     """
-    time = farc.Framework._event_loop.time()
-    evt = farc.Event(sig, time)
+    global _ring_tail
+    time = _loop_time()
+    if _ring_tail - _ring_head < RING_SIZE:
+        _ring[_ring_tail & (RING_SIZE - 1)] = (sig, pin_idx, time)
+        _ring_tail += 1
+        os.write(_wake_wr, b"\x01")
+
+
+# Guards against re-entering the framework dispatcher
+# from a publish made during dispatch
+_dispatching = False
+
+
+def _publish_pooled(sig, pin_idx, time):
+    """Publishes the given signal,
+    drawing the event from the signal's pool when one is available.
+    The event's value is the time of the edge, or a (pin_idx, time)
+    pair when the signal was registered with a pin index
+    (several pins sharing one signal).
+    Must be called from the event loop thread.
+    """
+    global _dispatching
+
+    value = time if pin_idx is None else (pin_idx, time)
+    pool = _evt_pools.get(sig)
+    if pool:
+        evt = pool.popleft()
+        evt.value = value
+    else:
+        evt = _PooledEvent(sig, value)
     farc.Framework.publish(evt)
 
+    # Fast path: publish() leaves the event queued for a dispatcher
+    # pass scheduled on the next loop iteration.  We are already in
+    # the loop thread, so run the dispatcher now and save the DIO
+    # event one full loop round-trip.  The later scheduled pass just
+    # finds the queues empty.
+    run = getattr(farc.Framework, "run", None)
+    if run is not None and not _dispatching:
+        _dispatching = True
+        try:
+            run()
+        finally:
+            _dispatching = False
+
+
+def _drain_ring():
+    """Publishes one event for every pin edge waiting on the ring buffer.
+    This callback runs in the event loop thread
+    (registered via loop.add_reader on the wake pipe).
+    """
+    global _ring_head
+    os.read(_wake_rd, RING_SIZE)
+    while _ring_head != _ring_tail:
+        sig, pin_idx, time = _ring[_ring_head & (RING_SIZE - 1)]
+        _ring[_ring_head & (RING_SIZE - 1)] = None
+        _ring_head += 1
+        _publish_pooled(sig, pin_idx, time)
+
 
 class GpioAhsm(farc.Ahsm):
     def __init__(self,):
+        global _wake_rd, _wake_wr
         super().__init__()
         GPIO.setmode(GPIO.BCM)
         self._out_pins = []
+        self._gpiod_chip = None
+        self._gpiod_lines = [] # libgpiod v1 line objects
+        self._gpiod_reqs = [] # libgpiod v2 line requests
+
+        # Create the wake pipe and have the event loop
+        # drain the pin-edge ring buffer when it is written
+        if _wake_rd is None:
+            _wake_rd, _wake_wr = os.pipe()
+            os.set_blocking(_wake_rd, False)
+            farc.Framework._event_loop.add_reader(_wake_rd, _drain_ring)
 
 
     @farc.Hsm.state
@@ -63,12 +206,18 @@ class GpioAhsm(farc.Ahsm):
     @farc.Hsm.state
     def _exiting(me, event):
         """State: GpioAhsm:_exiting
-        For each pin registered as an output,
-        sets the pin to an input (a safe condition).
+        Releases any gpiod lines and, for each pin registered
+        as an output, sets the pin to an input (a safe condition).
         """
         sig = event.signal
         if sig == farc.Signal.ENTRY:
-            for pin_nmbr in self._out_pins:
+            for line in me._gpiod_lines:
+                farc.Framework._event_loop.remove_reader(line.event_get_fd())
+                line.release()
+            for req in me._gpiod_reqs:
+                farc.Framework._event_loop.remove_reader(req.fd)
+                req.release()
+            for pin_nmbr in me._out_pins:
                 GPIO.setup(pin_nmbr, GPIO.IN)
             GPIO.cleanup()
             return me.handled(me, event)
@@ -76,12 +225,96 @@ class GpioAhsm(farc.Ahsm):
         return me.super(me, me.top)
 
 
-    def register_pin_in(self, pin_nmbr, pin_edge, sig_name):
+    def _on_pin_edge(self, line, sig_num, pin_idx):
+        """Publishes the registered signal for a kernel pin-edge event.
+        This callback runs in the event loop thread via loop.add_reader,
+        so there is no helper thread and no cross-thread hand-off.
+        The edge is timestamped with the kernel's timestamp
+        (sub-us accuracy, free of Python scheduling jitter);
+        if the kernel did not timestamp the event, the loop clock
+        is sampled instead.
+        """
+        edge_evt = line.event_read()
+        sec = getattr(edge_evt, "sec", None)
+        if sec is not None:
+            time = sec + edge_evt.nsec * 1e-9
+        else:
+            time = _loop_time()
+        _publish_pooled(sig_num, pin_idx, time)
+
+
+    def _on_pin_edge_v2(self, req, sig_num, pin_idx):
+        """Publishes the registered signal for libgpiod v2 edge events.
+        Like _on_pin_edge(), this runs in the event loop thread.
+        The v2 kernel timestamp is on the monotonic clock,
+        the same domain as the event loop's clock on Linux.
+        """
+        for edge_evt in req.read_edge_events():
+            _publish_pooled(sig_num, pin_idx, edge_evt.timestamp_ns * 1e-9)
+
+
+    def _register_gpiod_pin_v2(self, pin_nmbr, pin_edge, sig_num, pin_idx):
+        """Requests the pin's edge events via the libgpiod v2 API
+        and has the event loop read them directly from the request's fd.
+        """
+        Edge = gpiod.line.Edge
+        if pin_edge == GPIO.RISING:
+            edge = Edge.RISING
+        elif pin_edge == getattr(GPIO, "FALLING", None):
+            edge = Edge.FALLING
+        else:
+            edge = Edge.BOTH
+        req = gpiod.request_lines(
+            "/dev/" + GPIOD_CHIP,
+            consumer="sx127x_ahsm",
+            config={pin_nmbr: gpiod.LineSettings(edge_detection=edge)})
+        farc.Framework._event_loop.add_reader(
+            req.fd, self._on_pin_edge_v2, req, sig_num, pin_idx)
+        self._gpiod_reqs.append(req)
+
+
+    def _register_gpiod_pin(self, pin_nmbr, pin_edge, sig_num, pin_idx):
+        """Requests the pin's edge events from the kernel via gpiod
+        and has the event loop read them directly from the line's fd.
+        """
+        if self._gpiod_chip is None:
+            self._gpiod_chip = gpiod.Chip(GPIOD_CHIP)
+        line = self._gpiod_chip.get_line(pin_nmbr)
+        if pin_edge == GPIO.RISING:
+            req_type = gpiod.LINE_REQ_EV_RISING_EDGE
+        elif pin_edge == getattr(GPIO, "FALLING", None):
+            req_type = gpiod.LINE_REQ_EV_FALLING_EDGE
+        else:
+            req_type = gpiod.LINE_REQ_EV_BOTH_EDGES
+        line.request(consumer="sx127x_ahsm", type=req_type)
+        farc.Framework._event_loop.add_reader(
+            line.event_get_fd(), self._on_pin_edge, line, sig_num, pin_idx)
+        self._gpiod_lines.append(line)
+
+
+    def register_pin_in(self, pin_nmbr, pin_edge, sig_name, pin_idx=None):
         """Registers a signal to be published when the input pin edge is detected.
+        The published event's value is the time of the edge.
+        Several pins may share one signal name by passing a distinct
+        pin_idx for each; the event's value is then a (pin_idx, time)
+        pair, so one subscription covers all the pins and the
+        subscriber tells them apart by the index.
+        When the gpiod module is available, edges are read by the event
+        loop straight from the kernel's GPIO character device; otherwise
+        RPi.GPIO's callback thread and the ring buffer hand-off are used.
         """
-        sig_num = farc.Signal.register(sig_name)
+        sig_num = farc.Signal.register(sys.intern(sig_name))
+        if sig_num not in _evt_pools:
+            _evt_pools[sig_num] = collections.deque(
+                [_PooledEvent(sig_num) for _ in range(EVT_POOL_DEPTH)])
+        if _GPIOD_V2:
+            self._register_gpiod_pin_v2(pin_nmbr, pin_edge, sig_num, pin_idx)
+            return
+        if gpiod is not None:
+            self._register_gpiod_pin(pin_nmbr, pin_edge, sig_num, pin_idx)
+            return
         GPIO.setup(pin_nmbr, GPIO.IN)
-        GPIO.add_event_detect(pin_nmbr, edge=pin_edge, callback=lambda x: _gpio_input_handler(sig_num))
+        GPIO.add_event_detect(pin_nmbr, edge=pin_edge, callback=lambda x: _gpio_input_handler(sig_num, pin_idx))
 
 
     def register_pin_out(self, pin_nmbr, pin_initial):
@@ -10,24 +10,138 @@ Physical Layer State Machine for SX127x device
 - responds to GPIO events from the SX127x chip's DIOx pins
 """
 
+import collections
 import logging
+import sys
 import time
 
 import farc
 
+from . import phy_gpio_ahsm
 from . import phy_sx127x_spi
 
 
+# Bound method for the event loop's clock, saving the
+# farc.Framework._event_loop.time attribute walk on the hot path.
+# All deadlines in this module (rx_time, tx_time, the watchdog) are
+# floats in this clock's domain -- CLOCK_MONOTONIC under asyncio on
+# Linux -- which is the same domain farc's TimeEvent.postAt() uses.
+# The monotonic epoch is boot time, so a float of seconds keeps
+# sub-microsecond resolution for years of uptime; switching the
+# deadline math to integer nanoseconds would buy no precision and
+# would break the postAt() contract with the layer above.
+_loop_time = farc.Framework._event_loop.time
+
+# The value types for the PHY_RECEIVE and PHY_TRANSMIT events.
+# The layer above (MAC) should publish these; the handlers unpack
+# the value as a sequence, so a plain tuple of the same shape
+# still works.
+PhyRxCmd = collections.namedtuple("PhyRxCmd", "time freq")
+PhyTxCmd = collections.namedtuple("PhyTxCmd", "time freq data")
+
+# Module logger; the hot paths guard with isEnabledFor()
+# so disabled log levels cost one cached check, not a clock
+# read and a format-argument build
+_log = logging.getLogger(__name__)
+
+# IRQ flag bits cleared on the per-event RX paths,
+# hoisted to module constants to save the two-module
+# attribute walk per pin edge
+_IRQ_RXTMOUT = phy_sx127x_spi.IRQFLAGS_RXTIMEOUT_MASK
+_IRQ_VALIDHDR = phy_sx127x_spi.IRQFLAGS_VALIDHEADER_MASK
+
+# Register this module's signals once at import.
+# Signal registration is process-global, so doing it per state machine
+# start just re-hashed the same names into the framework's table.
+# The names are interned so the framework's name-to-number lookups
+# compare by pointer.
+for _sig_name in (
+        "_PHY_SPI_TMOUT", "_PHY_TX_TMOUT", # self-signaling (time events)
+        "PHY_RXD_DATA", "PHY_TX_DONE", # outgoing
+        "PHY_STDBY", "PHY_SET_LORA", # incoming
+        "PHY_SLEEP", "PHY_CAD", "PHY_RECEIVE", "PHY_TRANSMIT", # incoming from higher layer
+        "PHY_DIO"): # incoming from GPIO (value is (dio_idx, time))
+    farc.Signal.register(sys.intern(_sig_name))
+del _sig_name
+
+
+def _estimate_min_sleep(samples=100):
+    """Estimates the fixed cost of the shortest possible sleep.
+    Even time.sleep(0) pays a syscall and a scheduler visit,
+    so a requested sleep shorter than this just overshoots.
+    Sampled once at import.
+    """
+    t0 = time.perf_counter()
+    for _ in range(samples):
+        time.sleep(0)
+    return (time.perf_counter() - t0) / samples
+
+_MIN_SLEEP = _estimate_min_sleep()
+
+
+def precise_sleep(deadline, spin=0.0005):
+    """Sleeps until the given deadline (event loop clock).
+    Sleeps until just short of the deadline and busy-waits the
+    remainder, so the per-sleep OS overhead does not push the wakeup
+    past the deadline.  On Linux, time.sleep() rests on
+    clock_nanosleep and undershoot is tiny, so only the measured
+    fixed sleep cost is spun away; elsewhere time.sleep() can
+    overshoot by a millisecond or more and the full spin window
+    is used.  A deadline closer than the sleep floor skips the
+    sleep syscall entirely.
+    Returns immediately if the deadline has passed.
+    """
+    if sys.platform.startswith("linux"):
+        spin = _MIN_SLEEP
+    delta = deadline - _loop_time()
+    if delta <= 0.0:
+        return
+    if delta > spin:
+        time.sleep(delta - spin)
+    while _loop_time() < deadline:
+        pass
+
+
 class SX127xSpiAhsm(farc.Ahsm):
-    # Maximum amount of time to perform blocking sleep (seconds).
-    # If a sleep time longer than this is requested,
-    # the sleep time becomes this value.
-    MAX_BLOCKING_TIME = 0.050 # secs
+    # Slot storage for every attribute this class assigns, so the
+    # per-event attribute reads are an index instead of a dict
+    # lookup.  (The farc base classes carry no __slots__, so the
+    # instance keeps a __dict__ for the framework's own attributes;
+    # the names below still resolve through the faster descriptors.)
+    __slots__ = (
+        "spi_stngs", "dflt_modem_stngs", "sx127x",
+        "tm_evt", "tx_tmout_evt", "tx_tmout_deadline",
+        "rx_time", "rx_freq", "hdr_time",
+        "tx_time", "tx_freq", "tx_data", "tx_staged",
+        "_init_backoff", "_rx_fifo_blob", "_tx_fifo_blob",
+    )
 
     # Margin time added to transmit time
     # to allow other nodes to enable their receiver
     TX_MARGIN = 0.005 # secs
 
+    # How early the TX timer wakes before the transmit deadline.
+    # The loop timer never fires early but is routinely late;
+    # waking a guard interval ahead leaves precise_sleep() a
+    # remainder to close, so the transmit starts on the deadline
+    TMR_GUARD = 0.005 # secs
+
+    # Precomputed IRQ masks for the RX and TX prep sequences.
+    # These are static, so OR-ing them together per transition is waste.
+    _RX_IRQ_MASK = (phy_sx127x_spi.IRQFLAGS_RXTIMEOUT_MASK
+        | phy_sx127x_spi.IRQFLAGS_RXDONE_MASK
+        | phy_sx127x_spi.IRQFLAGS_PAYLOADCRCERROR_MASK
+        | phy_sx127x_spi.IRQFLAGS_VALIDHEADER_MASK)
+    _TX_IRQ_MASK = phy_sx127x_spi.IRQFLAGS_TXDONE_MASK
+
+    # Pre-packed DIO mapping register pairs (RegDioMapping1/2)
+    _RX_DIO_MAPPING = (0b00000001, 0b00000000) # DIO0=RxDone, DIO1=RxTmout, DIO3=ValidHdr
+    _TX_DIO_MAPPING = (0b01000000, 0b00000000) # DIO0=TxDone
+
+    # All DIO pins share the one PHY_DIO signal; the event's value
+    # carries the DIO index, so the radio-active states make a single
+    # subscription and tell the pins apart with a dict lookup.
+
 
     def __init__(self, spi_stngs, dflt_modem_stngs):
         super().__init__()
@@ -35,41 +149,211 @@ class SX127xSpiAhsm(farc.Ahsm):
         self.dflt_modem_stngs = dflt_modem_stngs
 
 
+    @classmethod
+    def _build_dispatch_tables(cls):
+        """Builds one {signal: handler} dict per state so that each state
+        dispatches an event with a single dict lookup instead of
+        walking an if/elif chain of signal comparisons.
+        Called once at import, after the signals are registered.
+        """
+        Signal = farc.Signal
+        cls._initializing_table = {
+            Signal.ENTRY: cls._initializing_entry,
+            Signal._PHY_SPI_TMOUT: cls._initializing_tmout,
+            Signal.EXIT: cls._initializing_exit,
+        }
+        cls._idling_table = {
+            Signal.ENTRY: cls._handled,
+            Signal.PHY_SLEEP: cls._idling_sleep,
+            Signal.PHY_SET_LORA: cls._idling_set_lora,
+            Signal.PHY_RECEIVE: cls._idling_receive,
+            Signal.PHY_TRANSMIT: cls._idling_transmit,
+            Signal.PHY_CAD: cls._idling_cad,
+        }
+        cls._working_table = {
+            Signal.ENTRY: cls._handled,
+            Signal.PHY_STDBY: cls._working_stdby,
+        }
+        cls._rx_prepping_table = {
+            Signal.ENTRY: cls._rx_prepping_entry,
+            Signal._PHY_SPI_TMOUT: cls._rx_prepping_tmout,
+            Signal.EXIT: cls._prepping_exit,
+        }
+        cls._listening_table = {
+            Signal.ENTRY: cls._listening_entry,
+            Signal.PHY_DIO: cls._listening_dio,
+            Signal.PHY_TRANSMIT: cls._listening_transmit,
+            Signal.EXIT: cls._listening_exit,
+        }
+        cls._receiving_table = {
+            Signal.ENTRY: cls._handled,
+            # PHY_DIO and PHY_TRANSMIT bubble to _listening: their
+            # handlers transition out of the RX chain, and taking
+            # the transition at _listening keeps _receiving AND
+            # _listening on farc's exit path so _listening_exit's
+            # DIO unsubscribe runs
+        }
+        cls._tx_prepping_table = {
+            Signal.ENTRY: cls._tx_prepping_entry,
+            Signal._PHY_SPI_TMOUT: cls._tx_prepping_tmout,
+            Signal.EXIT: cls._prepping_exit,
+        }
+        cls._transmitting_table = {
+            Signal.ENTRY: cls._transmitting_entry,
+            Signal.PHY_DIO: cls._transmitting_dio,
+            Signal._PHY_TX_TMOUT: cls._transmitting_tmout,
+            Signal.EXIT: cls._transmitting_exit,
+        }
+        cls._exiting_table = {
+            Signal.ENTRY: cls._exiting_entry,
+        }
+
+        # Flatten the hierarchy into the leaf tables: copy each parent
+        # state's handlers for signals its child does not handle into
+        # the child's table, so dispatching those signals costs one
+        # dict lookup instead of a climb of super() calls.
+        # Entry/exit actions are NOT copied -- the framework runs them
+        # per state during a transition -- and signals absent from the
+        # flattened table still take the super() path, which keeps the
+        # hierarchy discovery the framework relies on intact.
+        # Only handlers that return handled() may be copied: a copied
+        # handler runs with the child as the dispatcher's current
+        # state, so an inherited handler that calls tran() would hand
+        # the dispatcher the wrong transition source (e.g. a
+        # self-transition at the leaf) and corrupt its exit/entry
+        # path computation.  Handlers that transition stay in their
+        # own state's table and their signals bubble via super().
+        flatten_safe = (cls._handled, cls._idling_set_lora)
+
+        def _flatten(child_table, parent_table):
+            for sig, handler in parent_table.items():
+                if sig == Signal.ENTRY or sig == Signal.EXIT:
+                    continue
+                if handler not in flatten_safe:
+                    continue
+                child_table.setdefault(sig, handler)
+
+        _flatten(cls._rx_prepping_table, cls._idling_table)
+        _flatten(cls._tx_prepping_table, cls._idling_table)
+        _flatten(cls._listening_table, cls._working_table)
+        _flatten(cls._transmitting_table, cls._working_table)
+        # _listening is flattened first so _receiving picks up
+        # _working's handlers through it
+        _flatten(cls._receiving_table, cls._listening_table)
+
+        # Per-state DIO index dispatch: which pin means what
+        # depends only on the DIO mapping the state programmed
+        cls._listening_dio_handlers = {
+            0: cls._listening_rxdone, # DIO0: RxDone
+            1: cls._listening_rxtmout, # DIO1: RxTimeout
+            3: cls._listening_validhdr, # DIO3: ValidHeader
+        }
+        cls._transmitting_dio_handlers = {
+            0: cls._transmitting_txdone, # DIO0: TxDone
+        }
+
+        # Cache the signals emitted by the handlers
+        # so emitting is one class-attribute load
+        cls._sig_rxd_data = Signal.PHY_RXD_DATA
+        cls._sig_tx_done = Signal.PHY_TX_DONE
+
+
     @farc.Hsm.state
     def _initial(me, event):
         """Pseudostate: SX127xSpiAhsm:_initial
+        The signals are registered and the dispatch tables built
+        at module import; only the per-instance work remains here.
         """
-        # self-signaling
-        farc.Signal.register("_ALWAYS")
-
-        # Outgoing
-        farc.Signal.register("PHY_RXD_DATA")
-        farc.Signal.register("PHY_TX_DONE")
-
-        # Incoming
-        farc.Signal.register("PHY_STDBY")
-        farc.Signal.register("PHY_SET_LORA")
-
-        # Incoming from higher layer
+        # Incoming from higher layer.
+        # The DIO signal is not subscribed here; the states that act
+        # on pin edges subscribe to it on entry and unsubscribe on
+        # exit, so idle states are not woken just to discard them.
         farc.Framework.subscribe("PHY_SLEEP", me)
         farc.Framework.subscribe("PHY_CAD", me)
         farc.Framework.subscribe("PHY_RECEIVE", me)
         farc.Framework.subscribe("PHY_TRANSMIT", me)
 
-        # Incoming from GPIO (SX127x's DIO pins)
-        farc.Framework.subscribe("PHY_DIO0", me)
-        farc.Framework.subscribe("PHY_DIO1", me)
-        farc.Framework.subscribe("PHY_DIO2", me)
-        farc.Framework.subscribe("PHY_DIO3", me)
-        farc.Framework.subscribe("PHY_DIO4", me)
-        farc.Framework.subscribe("PHY_DIO5", me)
-
         # A time event used for setting timeouts
         me.tm_evt = farc.TimeEvent("_PHY_SPI_TMOUT")
 
+        # A dedicated time event for the transmit watchdog.
+        # Keeping it separate from tm_evt means a stale watchdog
+        # can be left to expire harmlessly instead of being
+        # disarmed (a timer-list removal) on every transmit.
+        me.tx_tmout_evt = farc.TimeEvent("_PHY_TX_TMOUT")
+        me.tx_tmout_deadline = 0.0
+
+        # True when the outgoing payload is already in the chip's FIFO
+        me.tx_staged = False
+
         return me.tran(me, SX127xSpiAhsm._initializing)
 
 
+    def _handled(me, event):
+        """Shared handler for signals that need no work.
+        """
+        return me.handled(me, event)
+
+
+    def _subscribe_dio(me):
+        """Subscribes this state machine to the shared DIO signal.
+        """
+        farc.Framework.subscribe("PHY_DIO", me)
+
+
+    def _unsubscribe_dio(me):
+        """Unsubscribes this state machine from the shared DIO signal.
+        Falls back to trimming the framework's subscriber table
+        when the installed farc does not offer unsubscribe().
+        """
+        unsubscribe = getattr(farc.Framework, "unsubscribe", None)
+        if unsubscribe is not None:
+            unsubscribe("PHY_DIO", me)
+            return
+        acts = farc.Framework._subscriber_table.get(farc.Signal.PHY_DIO)
+        if acts and me in acts:
+            acts.remove(me)
+
+
+#### _initializing state
+
+    def _initializing_entry(me, event):
+        me.sx127x = phy_sx127x_spi.SX127xSpi(me.spi_stngs)
+        me._init_backoff = 0.1
+        me.tm_evt.postIn(me, 0.0)
+        return me.handled(me, event)
+
+
+    def _initializing_tmout(me, event):
+        sx127x = me.sx127x
+        if sx127x.check_chip_ver():
+            sx127x.init(me.dflt_modem_stngs)
+            sx127x.set_pwr_cfg(boost=True)
+
+            # Precompute the FIFO pointer blobs (0x0D..) that the prep
+            # states burst-write on every packet, so the per-packet
+            # path does not rebuild them from the settings dict
+            modulation_stngs = me.dflt_modem_stngs["modulation_stngs"]
+            rx_base_ptr = modulation_stngs["rx_base_ptr"]
+            tx_base_ptr = modulation_stngs["tx_base_ptr"]
+            me._rx_fifo_blob = bytes((rx_base_ptr, tx_base_ptr, rx_base_ptr))
+            me._tx_fifo_blob = bytes((tx_base_ptr, tx_base_ptr))
+            return me.tran(me, SX127xSpiAhsm._idling)
+
+        # Retry with exponential backoff: a transient SPI glitch is
+        # retried within 100 ms, while an absent chip is probed
+        # ever more slowly instead of polling at a fixed 1 Hz forever
+        _log.info("_initializing: no SX127x or SPI")
+        me.tm_evt.postIn(me, me._init_backoff)
+        me._init_backoff = min(me._init_backoff * 2, 5.0)
+        return me.handled(me, event)
+
+
+    def _initializing_exit(me, event):
+        me.tm_evt.disarm()
+        return me.handled(me, event)
+
+
     @farc.Hsm.state
     def _initializing(me, event):
         """State: SX127xSpiAhsm:_initializing
@@ -78,256 +362,349 @@ class SX127xSpiAhsm(farc.Ahsm):
         otherwise transitions to the _exiting state
         so the SPI driver is closed.
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            me.sx127x = phy_sx127x_spi.SX127xSpi(me.spi_stngs)
-            me.tm_evt.postIn(me, 0.0)
-            return me.handled(me, event)
+        handler = SX127xSpiAhsm._initializing_table.get(event.signal)
+        if handler:
+            return handler(me, event)
+        return me.super(me, me.top)
 
-        elif sig == farc.Signal._PHY_SPI_TMOUT:
-            if me.sx127x.check_chip_ver():
-                me.sx127x.init(me.dflt_modem_stngs)
-                me.sx127x.set_pwr_cfg(boost=True)
-                return me.tran(me, SX127xSpiAhsm._idling)
 
-            logging.info("_initializing: no SX127x or SPI")
-            me.tm_evt.postIn(me, 1.0)
-            return me.handled(me, event)
+#### _idling state
 
-        elif sig == farc.Signal.EXIT:
-            me.tm_evt.disarm()
-            return me.handled(me, event)
+    def _idling_sleep(me, event):
+        return me.tran(me, me.sleeping)
 
-        return me.super(me, me.top)
 
+    def _idling_set_lora(me, event):
+        # TODO
+        return me.handled(me, event)
 
-    @farc.Hsm.state
-    def _idling(me, event):
-        """State: SX127xSpiAhsm:_idling
-        """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            return me.handled(me, event)
 
-        elif sig == farc.Signal.PHY_SLEEP:
-            return me.tran(me, me.sleeping)
+    def _idling_receive(me, event):
+        me.rx_time, me.rx_freq = event.value # PhyRxCmd
+        return me.tran(me, me._rx_prepping)
 
-        elif sig == farc.Signal.PHY_SET_LORA:
-            # TODO
-            return me.handled(me, event)
 
-        elif sig == farc.Signal.PHY_RECEIVE:
-            me.rx_time = event.value[0]
-            me.rx_freq = event.value[1]
-            return me.tran(me, me._rx_prepping)
+    def _idling_transmit(me, event):
+        me.tx_time, me.tx_freq, me.tx_data = event.value # PhyTxCmd
+
+        # Stage the payload into the chip's FIFO now, while idling.
+        # The FIFO burst is the largest SPI transfer of the prep
+        # sequence; doing it here moves it off the path between the
+        # TX deadline and set_op_mode("tx")
+        sx127x = me.sx127x
+        sx127x.write_burst(phy_sx127x_spi.REG_FIFO_PTR, me._tx_fifo_blob)
+        sx127x.set_tx_data(me.tx_data)
+        me.tx_staged = True
+        return me.tran(me, me._tx_prepping)
+
 
-        elif sig == farc.Signal.PHY_TRANSMIT:
-            me.tx_time = event.value[0]
-            me.tx_freq = event.value[1]
-            me.tx_data = event.value[2]
-            return me.tran(me, me._tx_prepping)
+    def _idling_cad(me, event):
+        return me.tran(me, me.cad_ing)
 
-        elif sig == farc.Signal.PHY_CAD:
-            return me.tran(me, me.cad_ing)
 
+    @farc.Hsm.state
+    def _idling(me, event):
+        """State: SX127xSpiAhsm:_idling
+        """
+        handler = SX127xSpiAhsm._idling_table.get(event.signal)
+        if handler:
+            return handler(me, event)
         return me.super(me, me.top)
 
 
+#### _working state
+
+    def _working_stdby(me, event):
+        me.sx127x.set_op_mode("stdby")
+        return me.tran(me, me._idling)
+
+
     @farc.Hsm.state
     def _working(me, event):
         """State SX127xSpiAhsm:_working
         This state provides a PHY_STDBY handler that returns the radio to stdby.
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            return me.handled(me, event)
-
-        elif sig == farc.Signal.PHY_STDBY:
-            me.sx127x.set_op_mode("stdby")
-            return me.tran(me, me._idling)
-
+        handler = SX127xSpiAhsm._working_table.get(event.signal)
+        if handler:
+            return handler(me, event)
         return me.super(me, me.top)
 
 
 #### Receive chain
+
+    def _rx_prepping_entry(me, event):
+        sx127x = me.sx127x
+
+        # Enable only the RX interrupts and clear any stale flags.
+        # The mask and flags registers are written in one burst,
+        # and writing the whole mask register needs no separate
+        # disable transaction.
+        sx127x.prep_lora_irqs(me._RX_IRQ_MASK)
+
+        # Prepare DIO0,1 to cause RxDone, RxTimeout, ValidHeader interrupts
+        sx127x.write_dio_mapping_raw(me._RX_DIO_MAPPING)
+
+        # One burst sets FIFO_PTR, TX_BASE_PTR and RX_BASE_PTR (0x0D..0x0F)
+        sx127x.write_burst(phy_sx127x_spi.REG_FIFO_PTR, me._rx_fifo_blob)
+        sx127x.set_lora_rx_freq(me.rx_freq)
+
+        # Clear the header timestamp for the coming RX session.
+        # This must not happen in _listening_entry: farc re-enters
+        # _listening on the way into _receiving, which would wipe
+        # the timestamp _listening_validhdr just captured.
+        me.hdr_time = 0
+
+        # Wake when it is time to receive.
+        # An rx_time already in the past fires on the next dispatch,
+        # and the event loop stays responsive either way.
+        me.tm_evt.postAt(me, me.rx_time)
+        return me.handled(me, event)
+
+
+    def _rx_prepping_tmout(me, event):
+        return me.tran(me, SX127xSpiAhsm._listening)
+
+
+    def _prepping_exit(me, event):
+        me.tm_evt.disarm()
+        return me.handled(me, event)
+
+
     @farc.Hsm.state
     def _rx_prepping(me, event):
         """State: SX127xSpiAhsm:_idling:_rx_prepping
         While still in radio's standby mode, get regs and FIFO ready for RX.
-        If a positive rx_time is given, sleep (blocking) for a tiny amount.
-        If rx_time is zero or less, receive immediately.
-        Always transfer to the Receiving state.
+        If the rx_time is in the future, schedule a wakeup for it;
+        if rx_time is zero or less, the wakeup fires on the next dispatch.
+        Never sleeps on the event loop thread.
+        Transitions to the _listening state on the wakeup.
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-
-            # Enable only the RX interrupts (disable all others)
-            me.sx127x.disable_lora_irqs()
-            me.sx127x.enable_lora_irqs(phy_sx127x_spi.IRQFLAGS_RXTIMEOUT_MASK
-                | phy_sx127x_spi.IRQFLAGS_RXDONE_MASK
-                | phy_sx127x_spi.IRQFLAGS_PAYLOADCRCERROR_MASK
-                | phy_sx127x_spi.IRQFLAGS_VALIDHEADER_MASK)
-
-            # Prepare DIO0,1 to cause RxDone, RxTimeout, ValidHeader interrupts
-            me.sx127x.set_dio_mapping(dio0=0, dio1=0, dio3=1)
-            me.sx127x.set_lora_rx_fifo(me.dflt_modem_stngs["modulation_stngs"]["rx_base_ptr"])
-            me.sx127x.set_lora_rx_freq(me.rx_freq)
-
-            # Reminder pattern
-            me.postFIFO(farc.Event(farc.Signal._ALWAYS, None))
-            return me.handled(me, event)
+        handler = SX127xSpiAhsm._rx_prepping_table.get(event.signal)
+        if handler:
+            return handler(me, event)
+        return me.super(me, me._idling)
 
-        elif sig == farc.Signal._ALWAYS:
-            if me.rx_time > 0:
-                tiny_sleep = me.rx_time - farc.Framework._event_loop.time()
-                if 0.0 < tiny_sleep < SX127xSpiAhsm.MAX_BLOCKING_TIME:
-                    time.sleep(tiny_sleep)
-            return me.tran(me, SX127xSpiAhsm._listening)
 
-        return me.super(me, me._idling)
+    def _listening_entry(me, event):
+        me._subscribe_dio()
+        if me.rx_time < 0:
+            me.sx127x.set_op_mode("rxcont")
+        else:
+            me.sx127x.set_op_mode("rxonce")
+        return me.handled(me, event)
 
 
-    @farc.Hsm.state
-    def _listening(me, event):
-        """State SX127xSpiAhsm:_working:_listening
-        If the rx_time is less than zero, listen continuously;
-        the caller must establish a way to end the continuous mode.
-        """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            me.hdr_time = 0
-            if me.rx_time < 0:
-                me.sx127x.set_op_mode("rxcont")
-            else:
-                me.sx127x.set_op_mode("rxonce")
-            return me.handled(me, event)
+    def _listening_exit(me, event):
+        me._unsubscribe_dio()
+        return me.handled(me, event)
 
-        elif sig == farc.Signal.PHY_DIO0: # RX_DONE
-            if me.sx127x.check_lora_rx_flags():
-                payld, rssi, snr = me.sx127x.get_lora_rxd()
-                pkt_data = (me.hdr_time, payld, rssi, snr)
-                farc.Framework.publish(farc.Event(farc.Signal.PHY_RXD_DATA, pkt_data))
-            else:
-                # TODO: crc error stats
-                logging.info("rx CRC error")
 
-            return me.tran(me, SX127xSpiAhsm._idling)
+    def _listening_dio(me, event):
+        handler = SX127xSpiAhsm._listening_dio_handlers.get(event.value[0])
+        if handler:
+            return handler(me, event)
+        phy_gpio_ahsm.release_evt(event)
+        return me.handled(me, event)
+
+
+    def _listening_rxdone(me, event): # RX_DONE
+        _, payld, rssi, snr = me.sx127x.read_rx_bundle()
+        if payld is not None:
+            pkt_data = (me.hdr_time, payld, rssi, snr)
+            farc.Framework.publish(farc.Event(me._sig_rxd_data, pkt_data))
+        else:
+            # TODO: crc error stats
+            _log.info("rx CRC error")
+
+        phy_gpio_ahsm.release_evt(event)
+        return me.tran(me, SX127xSpiAhsm._idling)
+
+
+    def _listening_rxtmout(me, event): # RX_TIMEOUT
+        me.sx127x.clear_lora_irqs(_IRQ_RXTMOUT)
+        phy_gpio_ahsm.release_evt(event)
+        return me.tran(me, SX127xSpiAhsm._idling)
 
-        elif sig == farc.Signal.PHY_DIO1: # RX_TIMEOUT
-            me.sx127x.clear_lora_irqs(phy_sx127x_spi.IRQFLAGS_RXTIMEOUT_MASK)
-            return me.tran(me, SX127xSpiAhsm._idling)
 
-        elif sig == farc.Signal.PHY_DIO3: # ValidHeader
-            me.hdr_time = event.value
-            me.sx127x.clear_lora_irqs(phy_sx127x_spi.IRQFLAGS_VALIDHEADER_MASK)
-            return me.tran(me, SX127xSpiAhsm._receiving)
+    def _listening_validhdr(me, event): # ValidHeader
+        me.hdr_time = event.value[1]
+        me.sx127x.clear_lora_irqs(_IRQ_VALIDHDR)
+        phy_gpio_ahsm.release_evt(event)
+        return me.tran(me, SX127xSpiAhsm._receiving)
 
+
+    def _listening_transmit(me, event):
         # We haven't received anything yet
         # and a request to Transmit arrives,
         # cancel the listening and go do the Transmit
-        elif sig == farc.Signal.PHY_TRANSMIT:
-            me.sx127x.set_op_mode("stdby")
-            me.tx_time = event.value[0]
-            me.tx_freq = event.value[1]
-            me.tx_data = event.value[2]
-            return me.tran(me, me._tx_prepping)
+        me.sx127x.set_op_mode("stdby")
+        me.tx_time, me.tx_freq, me.tx_data = event.value # PhyTxCmd
+        return me.tran(me, me._tx_prepping)
+
 
+    @farc.Hsm.state
+    def _listening(me, event):
+        """State SX127xSpiAhsm:_working:_listening
+        If the rx_time is less than zero, listen continuously;
+        the caller must establish a way to end the continuous mode.
+        """
+        handler = SX127xSpiAhsm._listening_table.get(event.signal)
+        if handler:
+            return handler(me, event)
         return me.super(me, me._working)
 
 
     @farc.Hsm.state
     def _receiving(me, event):
         """State SX127xSpiAhsm:_working:_listening:_receiving
+        A valid header has been seen; RxDone and RxTimeout
+        end the session and are handled by the parent state,
+        so farc exits both states on the way out.
         NOTE: This state should not be confused with
         the MAC layer state of the same name
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            pass
-
-        elif sig == farc.Signal.PHY_TRANSMIT:
-            # TODO: put the pkt in the tx queue
-            pass
-
+        handler = SX127xSpiAhsm._receiving_table.get(event.signal)
+        if handler:
+            return handler(me, event)
         return me.super(me, me._listening)
 
 
 #### Transmit chain
+
+    def _tx_prepping_entry(me, event):
+        sx127x = me.sx127x
+
+        # Enable only the TX interrupts and clear any stale flags.
+        # The mask and flags registers are written in one burst,
+        # and writing the whole mask register needs no separate
+        # disable transaction.
+        sx127x.prep_lora_irqs(me._TX_IRQ_MASK)
+
+        # Set DIO and freq in prep for transmit.
+        # The payload was staged into the FIFO when PHY_TRANSMIT
+        # arrived in _idling; restage it here only when it was not
+        # (e.g. the transmit preempted _listening)
+        sx127x.write_dio_mapping_raw(me._TX_DIO_MAPPING)
+        if not me.tx_staged:
+            sx127x.write_burst(phy_sx127x_spi.REG_FIFO_PTR, me._tx_fifo_blob)
+            sx127x.set_tx_data(me.tx_data)
+        me.tx_staged = False
+        sx127x.set_tx_freq(me.tx_freq)
+
+        if me.tx_time > 0:
+            # Apply a TX margin to the TX time
+            # to allow receivers time to get ready,
+            # then wake a guard interval early so precise_sleep()
+            # in the timeout handler closes the final stretch
+            target = me.tx_time + SX127xSpiAhsm.TX_MARGIN \
+                - SX127xSpiAhsm.TMR_GUARD
+        else:
+            # Transmit as soon as possible
+            target = 0.0
+
+        # Wake shortly before it is time to transmit.
+        # A target already in the past fires on the next dispatch,
+        # and the event loop stays responsive either way.
+        me.tm_evt.postAt(me, target)
+        return me.handled(me, event)
+
+
+    def _tx_prepping_tmout(me, event):
+        # The timer woke us a guard interval before the TX deadline
+        # (plus whatever lateness the loop added).  Close the
+        # remainder -- at most TMR_GUARD, so the blocking here is
+        # negligible -- with a precise sleep so the transmit starts
+        # on time.
+        if me.tx_time > 0:
+            precise_sleep(me.tx_time + SX127xSpiAhsm.TX_MARGIN)
+        return me.tran(me, SX127xSpiAhsm._transmitting)
+
+
     @farc.Hsm.state
     def _tx_prepping(me, event):
         """State: SX127xSpiAhsm:_idling:_tx_prepping
+        While still in radio's standby mode, get regs and FIFO ready for TX.
+        Never sleeps on the event loop thread.
+        Transitions to the _transmitting state on the timed wakeup.
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-
-            # Enable only the TX interrupts (disable all others)
-            me.sx127x.disable_lora_irqs()
-            me.sx127x.enable_lora_irqs(phy_sx127x_spi.IRQFLAGS_TXDONE_MASK)
-            me.sx127x.clear_lora_irqs(phy_sx127x_spi.IRQFLAGS_TXDONE_MASK)
-
-            # Set DIO, TX/FIFO_PTR, FIFO and freq in prep for transmit
-            me.sx127x.set_dio_mapping(dio0=1)
-            me.sx127x.set_lora_fifo_ptr()
-            me.sx127x.set_tx_data(me.tx_data)
-            me.sx127x.set_tx_freq(me.tx_freq)
-
-            # Reminder pattern
-            me.postFIFO(farc.Event(farc.Signal._ALWAYS, None))
+        handler = SX127xSpiAhsm._tx_prepping_table.get(event.signal)
+        if handler:
+            return handler(me, event)
+        return me.super(me, me._idling)
+
+
+    def _transmitting_entry(me, event):
+        me._subscribe_dio()
+        if _log.isEnabledFor(logging.INFO):
+            _log.info("tx             %f", _loop_time())
+        me.sx127x.set_op_mode("tx")
+
+        # Arm the TX watchdog, scaled to the packet's computed
+        # airtime so a missed TX_DONE is noticed within a couple of
+        # packet durations instead of a fixed second.  The deadline
+        # lets the timeout handler discard a stale watchdog left
+        # over from a previous transmit.
+        tmout = 2.0 * me.sx127x.compute_lora_airtime(len(me.tx_data)) + 0.050
+        me.tx_tmout_deadline = _loop_time() + tmout
+        me.tx_tmout_evt.postIn(me, tmout)
+        return me.handled(me, event)
+
+
+    def _transmitting_dio(me, event):
+        handler = SX127xSpiAhsm._transmitting_dio_handlers.get(event.value[0])
+        if handler:
+            return handler(me, event)
+        phy_gpio_ahsm.release_evt(event)
+        return me.handled(me, event)
+
+
+    def _transmitting_txdone(me, event): # TX_DONE
+        phy_gpio_ahsm.release_evt(event)
+        return me.tran(me, SX127xSpiAhsm._idling)
+
+
+    def _transmitting_tmout(me, event): # software timeout
+        # Ignore a stale watchdog from an earlier transmit
+        if _loop_time() < me.tx_tmout_deadline - 0.001:
             return me.handled(me, event)
+        me.sx127x.set_op_mode("stdby")
+        return me.tran(me, SX127xSpiAhsm._idling)
 
-        elif sig == farc.Signal._ALWAYS:
-            if me.tx_time > 0:
-                # Calculate precise sleep time and apply a TX margin
-                # to allow receivers time to get ready
-                tiny_sleep = me.tx_time - farc.Framework._event_loop.time()
-                tiny_sleep += SX127xSpiAhsm.TX_MARGIN
-
-                # If TX time has passed, don't sleep
-                # Else use sleep to get ~1ms precision
-                # Cap sleep at 50ms so we don't block for too long
-                if 0.0 < tiny_sleep: # because MAC layer uses 40ms PREP time
-                    if tiny_sleep > SX127xSpiAhsm.MAX_BLOCKING_TIME:
-                        tiny_sleep = SX127xSpiAhsm.MAX_BLOCKING_TIME
-                    time.sleep(tiny_sleep)
-            return me.tran(me, SX127xSpiAhsm._transmitting)
 
-        return me.super(me, me._idling)
+    def _transmitting_exit(me, event):
+        # Disarm the watchdog: farc forbids posting a TimeEvent that
+        # is still scheduled, so leaving it armed would trip an
+        # assert if the next transmit starts within the timeout.
+        me.tx_tmout_evt.disarm()
+        me._unsubscribe_dio()
+        farc.Framework.publish(farc.Event(me._sig_tx_done, None))
+        return me.handled(me, event)
 
 
     @farc.Hsm.state
     def _transmitting(me, event):
         """State: SX127xSpiAhsm:_working:_transmitting
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            logging.info("tx             %f", farc.Framework._event_loop.time())
-            me.sx127x.set_op_mode("tx")
-            me.tm_evt.postIn(me, 1.0) # TODO: make time scale with datarate
-            return me.handled(me, event)
-
-        elif sig == farc.Signal.PHY_DIO0: # TX_DONE
-            return me.tran(me, SX127xSpiAhsm._idling)
-
-        elif sig == farc.Signal._PHY_SPI_TMOUT: # software timeout
-            me.sx127x.set_op_mode("stdby")
-            return me.tran(me, SX127xSpiAhsm._idling)
+        handler = SX127xSpiAhsm._transmitting_table.get(event.signal)
+        if handler:
+            return handler(me, event)
+        return me.super(me, me._working)
 
-        elif sig == farc.Signal.EXIT:
-            me.tm_evt.disarm()
-            farc.Framework.publish(farc.Event(farc.Signal.PHY_TX_DONE, None))
-            return me.handled(me, event)
 
-        return me.super(me, me._working)
+    def _exiting_entry(me, event):
+        _log.info("_exiting")
+        me.sx127x.close()
+        return me.handled(me, event)
 
 
     @farc.Hsm.state
     def _exiting(me, event):
         """State: SX127xSpiAhsm:_exiting
         """
-        sig = event.signal
-        if sig == farc.Signal.ENTRY:
-            logging.info("_exiting")
-            me.sx127x.close()
-            return me.handled(me, event)
-
+        handler = SX127xSpiAhsm._exiting_table.get(event.signal)
+        if handler:
+            return handler(me, event)
         return me.super(me, me.top)
+
+
+SX127xSpiAhsm._build_dispatch_tables()
@@ -5,7 +5,10 @@ Copyright 2016 Dean Hall.  See LICENSE for details.
 
 
 import collections
+import ctypes
+import fcntl
 import logging
+import struct
 
 try:
     import spidev
@@ -16,10 +19,17 @@ from . import phy_sx127x_stngs
 
 
 SPI_CLK_MIN =   100000 # arbitrary (slowish)
-SPI_CLK_MAX = 20000000
+SPI_CLK_MAX = 32000000 # recent RasPis drive the bus this fast reliably
+SPI_CLK_SAFE = 10000000 # the datasheet's official maximum
 OSC_FREQ = 32e6
 INV_OSC_FREQ = 1.0 / OSC_FREQ
 
+# Integer form of the frequency <-> register-value ratio
+# (reg = freq * 2**19 / OSC_FREQ), so the conversion runs in
+# all-integer arithmetic with round-half-up instead of floats
+_FREQ_NUM = 1 << 19
+_FREQ_DEN = 32_000_000
+
 # The SX127x's Version register value
 CHIP_VERSION = 18
 
@@ -69,6 +79,89 @@ IRQFLAGS_CADDONE_MASK            = 0x04
 IRQFLAGS_FHSSCHANGEDCHANNEL_MASK = 0x02
 IRQFLAGS_CADDETECTED_MASK        = 0x01
 
+# Contiguous register spans accessed as single bursts via the
+# chip's address auto-increment, kept in one table so the burst
+# extents are auditable against the register map above.
+# Each entry is (start_addr, byte_count).
+REG_BLOCKS = {
+    "irq": (REG_IRQ_MASK, 2), # mask + flags
+    "rx_bundle": (REG_RX_CURRENT_ADDR, 11), # 0x10..0x1A: addr, irqs, nbytes, counts, status, snr, rssi
+    "modem_cfg": (REG_MODEM_CFG_1, 10), # 0x1D..0x26: cfg1/2, sym timeout, preamble, payld, cfg3
+    "fifo_ptrs": (REG_FIFO_PTR, 3), # ptr + tx/rx base ptrs
+}
+
+# Operating mode lookups for set_op_mode()/get_op_mode(),
+# built once at import instead of per call
+_MODE_LUT = {"sleep": 0b000,
+             "stdby": 0b001,
+             "standby": 0b001, # repeat for convenience
+             "fstx": 0b010,
+             "tx": 0b011,
+             "fsrx": 0b100,
+             "rxcont": 0b101,
+             "rx": 0b110, # same as rxonce
+             "rxonce": 0b110, # repeat for convenience
+             "cad": 0b111}
+_MODE_NAMES = ("sleep", "stdby", "fstx", "tx", "fsrx", "rxcont", "rx", "cad")
+
+# Modes the chip leaves on its own: it auto-returns to stdby
+# after TxDone, after RxDone/RxTimeout in rxonce, and after
+# CadDone, so the driver's mode mirror cannot be trusted once
+# one of these has been commanded
+_SELF_CLEARING_MODES = (0b011, 0b110, 0b111) # tx, rxonce, cad
+
+# ERRATA 2.3 (receiver spurious reception) values,
+# indexed by the bandwidth index: the rx frequency offset
+# and the value for the undocumented register 0x2F
+_ERRATA_RX_OFFSET_LUT = (7810.0, 10420.0, 15620.0, 20830.0, 31250.0, 41670.0, 0.0, 0.0, 0.0, 0.0)
+_ERRATA_2F_LUT = (0x48, 0x44, 0x44, 0x44, 0x44, 0x44, 0x40, 0x40, 0x40)
+
+# Layout of the kernel's struct spi_ioc_transfer
+# (tx_buf, rx_buf, len, speed_hz, delay_usecs,
+#  bits_per_word, cs_change, tx_nbits, rx_nbits, pad)
+_SPI_IOC_TRANSFER = struct.Struct("=QQIIHBBBBH")
+
+def _SPI_IOC_MESSAGE(n):
+    """Builds the SPI_IOC_MESSAGE(n) ioctl request number
+    for n spi_ioc_transfer descriptors.
+    """
+    return 0x40006B00 | ((n * _SPI_IOC_TRANSFER.size) & 0x1FFF) << 16
+
+_SPI_IOC_MESSAGE_1 = _SPI_IOC_MESSAGE(1)
+_SPI_IOC_MESSAGE_2 = _SPI_IOC_MESSAGE(2)
+
+# Pre-bound struct codecs for multi-byte register conversions;
+# one C call replaces the per-byte shift-and-or Python bytecode
+_PACK_U32 = struct.Struct(">I").pack
+_UNPACK_U32 = struct.Struct(">I").unpack
+_UNPACK_2U16 = struct.Struct(">HH").unpack
+
+
+# Snapshot of the LoRa modem status registers (0x14..0x18)
+# returned by get_lora_status()
+LoRaStatus = collections.namedtuple("LoRaStatus", (
+    "rx_hdr_cnt", "rx_pkt_cnt", "rx_code_rate", "modem_clr",
+    "hdr_info_valid", "rx_busy", "sig_sync", "sig_detected"))
+
+
+class _SpiIocTransfer(ctypes.Structure):
+    """Mirror of struct spi_ioc_transfer from <linux/spi/spidev.h>,
+    passed straight to the SPI_IOC_MESSAGE ioctl so single register
+    transactions skip spidev's per-call list marshalling.
+    """
+    _fields_ = [
+        ("tx_buf", ctypes.c_uint64),
+        ("rx_buf", ctypes.c_uint64),
+        ("len", ctypes.c_uint32),
+        ("speed_hz", ctypes.c_uint32),
+        ("delay_usecs", ctypes.c_uint16),
+        ("bits_per_word", ctypes.c_uint8),
+        ("cs_change", ctypes.c_uint8),
+        ("tx_nbits", ctypes.c_uint8),
+        ("rx_nbits", ctypes.c_uint8),
+        ("pad", ctypes.c_uint16),
+    ]
+
 
 class SX127xSpi(object):
     """Offers methods that drive the SPI bus to control the Semtech SX127x.
@@ -87,42 +180,171 @@ class SX127xSpi(object):
         self.spi.max_speed_hz = spi_stngs[2]
         self.spi.mode = 0 # phase=0 and polarity=0
 
+        # Preallocated scratch buffers for FIFO transfers
+        # (the address byte plus the 256 byte FIFO),
+        # reused so the packet path does not allocate per call
+        self._tx_buf = bytearray(257)
+        self._rx_buf = bytearray(257)
+
+        # Python-side mirrors of chip state written by this driver.
+        # Valid until the driver itself writes the registers,
+        # so getters and redundant setters can skip the SPI read.
+        self._mode_cache = None # 3-bit device mode field
+        self._freq_cache = None # carrier freq [Hz]
+        self._dio_cache = None # (map_reg1, map_reg2) pair
+        self._last_cfg_id = None # identity of last-applied settings
+
+        # Direct ioctl path for single transfers: spidev's xfer2
+        # converts the buffer to and from a Python list per call.
+        # When the device exposes a file descriptor, issue the
+        # SPI_IOC_MESSAGE ioctl ourselves, full duplex in place on
+        # the scratch buffers.  The ctypes views pin the buffers'
+        # addresses once so the per-call work is three field stores.
+        fileno = getattr(self.spi, "fileno", None)
+        if fileno is not None:
+            self._fd = fileno()
+            self._xfer = _SpiIocTransfer()
+            self._tx_addr = ctypes.addressof(
+                (ctypes.c_char * len(self._tx_buf)).from_buffer(self._tx_buf))
+            self._rx_addr = ctypes.addressof(
+                (ctypes.c_char * len(self._rx_buf)).from_buffer(self._rx_buf))
+
+            # Chained descriptor pair for set_tx_data(): the payload
+            # length write and the FIFO fill ride one ioctl, with CS
+            # deasserted between them.  Only the length byte and the
+            # FIFO transfer length change per packet.
+            self._txdata_hdr = bytearray((REG_PAYLD_LEN | WRITE_BIT, 0))
+            hdr_addr = ctypes.addressof(
+                (ctypes.c_char * 2).from_buffer(self._txdata_hdr))
+            self._xfer_pair = (_SpiIocTransfer * 2)()
+            pair = self._xfer_pair
+            pair[0].tx_buf = pair[0].rx_buf = hdr_addr
+            pair[0].len = 2
+            pair[0].cs_change = 1 # deassert CS between the messages
+            pair[1].tx_buf = pair[1].rx_buf = self._tx_addr
+        else:
+            self._fd = None
+
+        # Bound pure-write method (spidev >= 3.5), detected once.
+        # writebytes2 accepts bytes-like objects directly and skips
+        # building the read-back list that xfer2 returns.
+        self._writebytes2 = getattr(self.spi, "writebytes2", None)
+
+        # The datasheet caps the SPI clock at 10 MHz, but many boards
+        # run faster reliably and a 255 byte FIFO transfer is SPI
+        # bandwidth bound.  When a faster clock was requested, prove
+        # it with repeated Version register reads and fall back to
+        # the datasheet rate on any mismatch.
+        if spi_stngs[2] > SPI_CLK_SAFE and not self._probe_spi_clk():
+            logging.info(
+                "SPI clk %d Hz failed verification; using %d Hz"
+                % (spi_stngs[2], SPI_CLK_SAFE))
+            self.spi.max_speed_hz = SPI_CLK_SAFE
+
 
 ## SPI helper methods
 
     def _read(self, reg_addr, nbytes=1):
         """Reads a byte (or more) from the register.
         Returns list of bytes (even if there is only one).
+        Stages the transfer through the preallocated buffer
+        so the hot path builds no per-transaction list.
         """
-        assert type(nbytes) is int
-        assert nbytes > 0
-        b = [reg_addr,]
-        b.extend([0,] * nbytes)
-        return self.spi.xfer2(b)[1:]
+        buf = self._rx_buf
+        buf[0] = reg_addr
+        buf[1:nbytes + 1] = bytes(nbytes)
+        if self._fd is None:
+            return self.spi.xfer2(buf[:nbytes + 1])[1:]
+        xfer = self._xfer
+        xfer.tx_buf = self._rx_addr
+        xfer.rx_buf = self._rx_addr
+        xfer.len = nbytes + 1
+        fcntl.ioctl(self._fd, _SPI_IOC_MESSAGE_1, xfer)
+        return list(buf[1:nbytes + 1])
 
 
     def _write(self, reg_addr, data):
         """Writes one or more bytes to the register.
-        Returns list of bytes (even if there is only one).
+        data is an int for one byte, or a sequence of ints.
+        Stages the transfer through the preallocated buffer
+        so the hot path builds no per-transaction list.
+        The bytes clocked back in are discarded; use _read to read.
         """
-        assert type(data) == int or isinstance(data, collections.Sequence)
+        buf = self._tx_buf
 
         # Set the write bit (MSb)
-        reg_addr |= WRITE_BIT
+        buf[0] = reg_addr | WRITE_BIT
 
-        # Build the list of bytes to write
         if type(data) == int:
-            data &= 0xff
-            b = [reg_addr, data]
+            buf[1] = data & 0xff
+            end = 2
         else:
-            b = [reg_addr,]
-            b.extend(data)
-
-        return self.spi.xfer2(b)[1:]
+            end = 1 + len(data)
+            buf[1:end] = data
+        if self._fd is not None:
+            xfer = self._xfer
+            xfer.tx_buf = self._tx_addr
+            xfer.rx_buf = self._tx_addr
+            xfer.len = end
+            fcntl.ioctl(self._fd, _SPI_IOC_MESSAGE_1, xfer)
+        elif self._writebytes2 is not None:
+            self._writebytes2(buf[:end])
+        else:
+            self.spi.xfer2(buf[:end])
 
 
 ## SX127x general methods
 
+    def xfer_batch(self, msgs):
+        """Issues the given transfers as one multi-message SPI ioctl.
+        Each message is a sequence of bytes beginning with the
+        register address byte.  The kernel runs the messages back to
+        back, toggling chip select between them, so a chain of small
+        register transactions costs one syscall instead of one each.
+        Returns a list with the bytes read back for each message
+        (same shape as calling xfer2 per message).
+        Falls back to one xfer2() per message when the SPI device
+        does not expose a file descriptor (e.g. the mock driver).
+        """
+        if self._fd is None:
+            return [self.spi.xfer2(list(m)) for m in msgs]
+
+        # Full-duplex in place: each message's buffer is both
+        # the MOSI source and the MISO destination
+        bufs = [ctypes.create_string_buffer(bytes(m), len(m)) for m in msgs]
+        xfers = bytearray()
+        last = len(bufs) - 1
+        for i, buf in enumerate(bufs):
+            addr = ctypes.addressof(buf)
+            xfers += _SPI_IOC_TRANSFER.pack(
+                addr, addr, len(buf), 0, 0, 0,
+                1 if i < last else 0, # deassert CS between messages
+                0, 0, 0)
+        fcntl.ioctl(self._fd, _SPI_IOC_MESSAGE(len(bufs)), xfers, True)
+        return [list(buf.raw) for buf in bufs]
+
+
+    def write_burst(self, reg_addr, data):
+        """Writes the sequence of bytes to consecutive registers
+        beginning at the given register address.
+        The SX127x auto-increments the register address after each byte,
+        so a run of adjacent registers costs one SPI transaction
+        (one syscall and one chip-select toggle) instead of one each.
+        """
+        self._write(reg_addr, data)
+
+
+    def _probe_spi_clk(self, tries=100):
+        """Returns True if the Version register reads back correctly
+        the given number of times in a row at the current SPI clock.
+        A marginal clock rate shows up as corrupt reads.
+        """
+        for _ in range(tries):
+            if self._read(REG_VERSION)[0] != CHIP_VERSION:
+                return False
+        return True
+
+
     def check_chip_ver(self,):
         """Returns True if the Semtech SX127x returns the proper value
         from the Version register.  This proves the chip and the SPI bus
@@ -156,6 +378,11 @@ class SX127xSpi(object):
     def close(self,):
         """Closes the SPI port.
         """
+        self._mode_cache = None
+        self._freq_cache = None
+        self._dio_cache = None
+        self._last_cfg_id = None
+        self._fd = None
         self.spi.close()
 
 
@@ -165,23 +392,30 @@ class SX127xSpi(object):
         Returns nothing.
         """
         map1, map2 = self._read(REG_DIO_MAPPING1, 2)
-        dio = bytearray()
-        dio.append((map1 >> 6) & 0b11) # DIO0
-        dio.append((map1 >> 4) & 0b11) # DIO1
-        dio.append((map1 >> 2) & 0b11) # DIO2
-        dio.append((map1 >> 0) & 0b11) # DIO3
-        dio.append((map2 >> 6) & 0b11) # DIO4
-        dio.append((map2 >> 4) & 0b11) # DIO5
-        self.dio_mapping = dio
+        self.dio_mapping = (
+            (map1 >> 6) & 0b11, # DIO0
+            (map1 >> 4) & 0b11, # DIO1
+            (map1 >> 2) & 0b11, # DIO2
+            (map1 >> 0) & 0b11, # DIO3
+            (map2 >> 6) & 0b11, # DIO4
+            (map2 >> 4) & 0b11) # DIO5
 
 
     def get_op_mode(self,):
         """Gets the device mode field of the Op Mode register
         and returns a string representation of the mode.
+        Returns the mirrored mode without an SPI read
+        when this driver was the last to set the mode.
         """
-        mode_lut = ("sleep", "stdby", "fstx", "tx", "fsrx", "rxcont", "rx", "cad")
-        d = self._read(REG_OP_MODE)
-        self.mode = mode_lut[d[0] & 0b111]
+        bits = self._mode_cache
+        if bits is None:
+            bits = self._read(REG_OP_MODE)[0] & 0b111
+            # A self-clearing mode read back from the chip may end
+            # (auto-return to stdby) at any moment, so it must not
+            # repopulate the mirror
+            if bits not in _SELF_CLEARING_MODES:
+                self._mode_cache = bits
+        self.mode = _MODE_NAMES[bits]
         return self.mode
 
 
@@ -202,9 +436,11 @@ class SX127xSpi(object):
         # If DIO mapping has not been read from device
         # create a mapping of all zeros
         if not hasattr(self, "dio_mapping"):
-            self.dio_mapping = [0,] * 6
+            self.dio_mapping = (0,) * 6
 
-        dio_seq = self.dio_mapping
+        # The stored mapping is an immutable tuple;
+        # mutate a list copy only while writing
+        dio_seq = list(self.dio_mapping)
 
         # put any kwargs into the sequence
         for k,v in dio_args.items():
@@ -214,14 +450,40 @@ class SX127xSpi(object):
             assert v in (0,1,2,3), "dio_args has a bad value"
             dio_seq[dio_int] = v
 
-        # build the register values from the sequence
-        map_reg1 = (dio_seq[0] & 0x03) << 6 \
-                 | (dio_seq[1] & 0x03) << 4 \
-                 | (dio_seq[2] & 0x03) << 2 \
-                 | (dio_seq[3] & 0x03)
-        map_reg2 = (dio_seq[4] & 0x03) << 6 \
-                 | (dio_seq[5] & 0x03) << 4
+        # Build the register values from the sequence.
+        # The fields were validated to 0..3 above, so they pack
+        # straight into place without per-field masking.
+        map_reg1 = dio_seq[0] << 6 \
+                 | dio_seq[1] << 4 \
+                 | dio_seq[2] << 2 \
+                 | dio_seq[3]
+        map_reg2 = dio_seq[4] << 6 \
+                 | dio_seq[5] << 4
         self._write(REG_DIO_MAPPING1, [map_reg1, map_reg2])
+        self._dio_cache = (map_reg1, map_reg2)
+        self.dio_mapping = tuple(dio_seq)
+
+
+    def write_dio_mapping_raw(self, mapping_bytes):
+        """Writes pre-packed values to the two DIO mapping registers
+        and keeps the stored mapping in sync.
+        This skips the per-field packing done by set_dio_mapping()
+        for callers whose mapping is a known constant,
+        and skips the SPI write entirely when the chip
+        already holds the requested mapping.
+        """
+        map1, map2 = mapping_bytes
+        if (map1, map2) == self._dio_cache:
+            return
+        self._write(REG_DIO_MAPPING1, [map1, map2])
+        self._dio_cache = (map1, map2)
+        self.dio_mapping = (
+            (map1 >> 6) & 0b11, # DIO0
+            (map1 >> 4) & 0b11, # DIO1
+            (map1 >> 2) & 0b11, # DIO2
+            (map1 >> 0) & 0b11, # DIO3
+            (map2 >> 6) & 0b11, # DIO4
+            (map2 >> 4) & 0b11) # DIO5
 
 
     def set_modem(self, modem_stngs):
@@ -247,13 +509,17 @@ class SX127xSpi(object):
     def get_rf_freq(self,):
         """Reads the frequency registers
         and returns the calculated frequency.
+        Returns the mirrored frequency without an SPI read
+        when this driver was the last to set the frequency.
         WARNING: The frequency registers will contain an offset
         if the radio's last operation was receive
         (but some bandwidths have 0.0 offset).
         """
-        hi,med,low = self._read(REG_CARRIER_FREQ, 3)
-        val = hi << 16 | med << 8 | low
-        return int(round(val * OSC_FREQ / 2**19))
+        if self._freq_cache is not None:
+            return self._freq_cache
+        val = _UNPACK_U32(bytes((0,)) + bytes(self._read(REG_CARRIER_FREQ, 3)))[0]
+        self._freq_cache = (val * _FREQ_DEN + (_FREQ_NUM >> 1)) // _FREQ_NUM
+        return self._freq_cache
 
 
     def set_rf(self, **rf_stngs):
@@ -304,7 +570,7 @@ class SX127xSpi(object):
         for each IRQ flag to clear.
         If no argument is given, all IRQ flags are cleared.
         """
-        if irq_bits:
+        if irq_bits is not None:
             d = irq_bits
         else:
             d = 0xFF
@@ -318,13 +584,30 @@ class SX127xSpi(object):
         IRQs are enabled by writing a zero
         to the bit in the mask register.
         """
-        if irq_bits:
+        if irq_bits is not None:
             d = ~irq_bits
         else:
             d = 0x00
         self._write(REG_IRQ_MASK, d)
 
 
+    def set_lora_irqs(self, enable_bits, clear_bits=0xFF):
+        """Enables the given IRQs and clears the given flags
+        in a single 2-byte burst write.
+        REG_IRQ_MASK (0x11) and REG_IRQ_FLAGS (0x12) are adjacent,
+        so the chip's auto-increment covers the enable and the clear
+        in one SPI transaction instead of two.
+        """
+        self._write(REG_IRQ_MASK, [(~enable_bits) & 0xff, clear_bits & 0xff])
+
+
+    def prep_lora_irqs(self, irq_bits):
+        """Enables the given IRQs and clears their flags
+        in a single 2-byte burst write.
+        """
+        self.set_lora_irqs(irq_bits, irq_bits)
+
+
     def disable_lora_irqs(self, irq_bits=None):
         """Disables one or more IRQs.
         If an argument is given, it is a byte
@@ -333,7 +616,7 @@ class SX127xSpi(object):
         IRQs are disabled by writing a one
         to the bit in the mask register.
         """
-        if irq_bits:
+        if irq_bits is not None:
             d = irq_bits
         else:
             d = 0xFF
@@ -369,41 +652,138 @@ class SX127xSpi(object):
         rssi is an integer [dBm].
         snr is a float [dB].
         """
-        # Get the index into the FIFO of where the pkt starts
-        # and the length of the data received
-        pkt_start, _, _, nbytes = self._read(REG_RX_CURRENT_ADDR, 4)
+        # One burst read (0x10..0x1A) gets the index into the FIFO
+        # of where the pkt starts, the length of the data received
+        # and the packet SNR and RSSI, saving the separate SNR/RSSI
+        # transaction
+        d = self._read(*REG_BLOCKS["rx_bundle"])
+        pkt_start = d[0]
+        nbytes = d[3]
+        snr = d[9] / 4.0 # [dB]
+        rssi = -157 + d[10] # [dBm]
 
         # Error checking (that pkt started at 0)
 #        if pkt_start != 0: "pkt_start was %d" % pkt_start # TODO: logging
 
-        # Read the payload
+        # Read the payload through the preallocated buffer
+        # (the chip ignores MOSI during a read, so the buffer
+        # does not need to be zeroed)
         self._write(REG_FIFO_PTR, pkt_start)
-        payld = self._read(REG_FIFO, nbytes)
-
-        # Get the packet SNR and RSSI (2 consecutive regs)
-        # and calculate RSSI [dBm] and SNR [dB]
-        snr, rssi = self._read(REG_PKT_SNR, 2)
-        rssi = -157 + rssi
-        snr = snr / 4.0
+        buf = self._rx_buf
+        buf[0] = REG_FIFO
+        payld = self.spi.xfer2(buf[:1 + nbytes])[1:]
 
         return (payld, rssi, snr)
 
 
+    def compute_lora_airtime(self, payld_len):
+        """Returns the on-air time [s] of a LoRa packet
+        with the given payload length [bytes],
+        computed from the current LoRa settings
+        using the formula in Semtech AN1200.13.
+        """
+        stngs = self.lora_stngs
+        sf = stngs["_spread_factor_idx"]
+        t_sym = float(2 ** sf) / stngs["bandwidth"]
+        t_preamble = (stngs["preamble_len"] + 4.25) * t_sym
+
+        # Number of payload symbols (ceiling division)
+        n = ( 8 * payld_len - 4 * sf + 28
+            + 16 * int(stngs["en_crc"])
+            - 20 * int(stngs["implct_hdr_mode"]))
+        d = 4 * (sf - 2 * int(stngs["en_ldr"]))
+        n_payld = 8 + max(-(-n // d) * (stngs["_code_rate_idx"] + 4), 0)
+
+        return t_preamble + n_payld * t_sym
+
+
+    def read_rx_bundle(self,):
+        """Reads everything needed to deliver a received packet.
+        One burst read covers RX_CURRENT_ADDR through PKT_RSSI
+        (0x10..0x1A), the rx-related IRQ flags are cleared and the
+        payload is read from the FIFO in a second burst, so the whole
+        post-RxDone sequence costs four SPI transactions instead of
+        the six taken by check_lora_rx_flags() plus get_lora_rxd().
+        Returns a tuple of: (irq_flags, payld, rssi, snr)
+        payld is a list of integers,
+        or None if the flags indicate no valid packet
+        (rx timeout or payload CRC error).
+        rssi is an integer [dBm].
+        snr is a float [dB].
+        """
+        return self._deliver_rx_bundle(self._read(*REG_BLOCKS["rx_bundle"]))
+
+
+    def rx_packet_if_ready(self,):
+        """Polls for a completed receive and delivers it in one pass.
+        Returns None without touching the IRQ flags when RxDone
+        is not set; otherwise returns read_rx_bundle()'s tuple.
+        One bundle read serves as both the poll and the packet
+        metadata, so a poll-plus-delivery costs at most four SPI
+        transactions instead of running check_lora_rx_flags()
+        and then get_lora_rxd().
+        """
+        d = self._read(*REG_BLOCKS["rx_bundle"])
+        if not (d[2] & IRQFLAGS_RXDONE_MASK):
+            return None
+        return self._deliver_rx_bundle(d)
+
+
+    def _deliver_rx_bundle(self, d):
+        """Clears the rx IRQ flags and reads out the packet described
+        by a rx_bundle register read (see read_rx_bundle for the
+        returned tuple).
+        """
+        pkt_start = d[0]
+        irq_flags = d[2]
+        nbytes = d[3]
+        snr = d[9] / 4.0
+        rssi = -157 + d[10]
+
+        rx_flags = irq_flags & ( IRQFLAGS_RXTIMEOUT_MASK
+                               | IRQFLAGS_RXDONE_MASK
+                               | IRQFLAGS_PAYLOADCRCERROR_MASK
+                               | IRQFLAGS_VALIDHEADER_MASK )
+
+        if (not (irq_flags & IRQFLAGS_RXDONE_MASK)
+                or irq_flags & ( IRQFLAGS_RXTIMEOUT_MASK
+                               | IRQFLAGS_PAYLOADCRCERROR_MASK )):
+            # Clear the rx-related IRQ flags in the reg
+            self._write(REG_IRQ_FLAGS, rx_flags)
+            return (irq_flags, None, rssi, snr)
+
+        # One multi-message ioctl clears the rx-related IRQ flags,
+        # seeks the FIFO to the packet and reads the payload
+        # (the chip ignores MOSI during a read, so the payload
+        # buffer does not need to be zeroed)
+        buf = self._rx_buf
+        buf[0] = REG_FIFO
+        rxd = self.xfer_batch([
+            (REG_IRQ_FLAGS | WRITE_BIT, rx_flags),
+            (REG_FIFO_PTR | WRITE_BIT, pkt_start),
+            buf[:1 + nbytes]])
+        payld = rxd[2][1:]
+
+        return (irq_flags, payld, rssi, snr)
+
+
     def get_lora_status(self,):
         """Gets status fields.
-        Returns a dict of status fields.
+        Returns a LoRaStatus namedtuple, a single immutable
+        allocation per call that pollers may keep as a snapshot.
         """
         d = self._read(REG_RX_HDR_CNT, 5)
-        s = {}
-        s["rx_hdr_cnt"] = d[0] << 8 | d[1]
-        s["rx_pkt_cnt"] = d[2] << 8 | d[3]
-        s["rx_code_rate"] = d[4] >> 5
-        s["modem_clr"] = (d[4] & 0x10) != 0
-        s["hdr_info_valid"] = (d[4] & 0x08) != 0
-        s["rx_busy"] = (d[4] & 0x04) != 0
-        s["sig_sync"] = (d[4] & 0x01) != 0
-        s["sig_detected"] = (d[4] & 0x01) != 0
-        return s
+        rx_hdr_cnt, rx_pkt_cnt = _UNPACK_2U16(bytes(d[:4]))
+        stat = d[4]
+        return LoRaStatus(
+            rx_hdr_cnt,
+            rx_pkt_cnt,
+            stat >> 5,
+            (stat & 0x10) != 0,
+            (stat & 0x08) != 0,
+            (stat & 0x04) != 0,
+            (stat & 0x02) != 0,
+            (stat & 0x01) != 0)
 
 
     def set_lora_settings(self, lora_stngs):
@@ -411,12 +791,28 @@ class SX127xSpi(object):
         Caller should ensure the device is not busy.
         This method puts the device into sleep mode and returns it
         to its current mode.
+        If the same settings object with unchanged values was already
+        applied, the method returns without touching the device;
+        duty-cycled apps reapply one profile over and over.
         """
         assert isinstance(lora_stngs, phy_sx127x_stngs.SX127xLoraSettings)
 
+        cfg_id = (id(lora_stngs), lora_stngs.version_tuple())
+        if cfg_id == self._last_cfg_id:
+            return
+
         # Save lora_stngs (used by other set_* methods)
         self.lora_stngs = lora_stngs
 
+        # Precompute the Errata 2.3 rx-rejection parameters; they
+        # depend only on the bandwidth, so set_lora_rx_freq() does
+        # no table lookups or branches per frequency change
+        bw_idx = lora_stngs["_bandwidth_idx"]
+        self._rx_offset = _ERRATA_RX_OFFSET_LUT[bw_idx]
+        self._reg31_msb = bw_idx == 0b1001
+        self._reg2f_data = None if self._reg31_msb \
+            else (_ERRATA_2F_LUT[bw_idx], 0)
+
         # Transition to sleep mode to write configuration
         mode_bkup = self.get_op_mode()
         if mode_bkup != "sleep":
@@ -433,16 +829,22 @@ class SX127xSpi(object):
             | ((lora_stngs["symbol_count"] >> 8) & 0b011)
         # Lower 8 bits of symbol count go in reg(0x1F)
         reg_sym_to = lora_stngs["symbol_count"] & 0xff
-        # Write 3 contiguous regs at once
-        self._write(REG_MODEM_CFG_1, [reg_cfg1, reg_cfg2, reg_sym_to])
+        # Cfg3 reg
+        reg_cfg3 = int(lora_stngs["en_ldr"]) << 3 | int(lora_stngs["agc_auto"]) << 2
 
-        # Write preamble register
-        reg_preamble_len = [lora_stngs["preamble_len"] >> 8, lora_stngs["preamble_len"] & 0xff]
-        self._write(REG_PREAMBLE_LEN, reg_preamble_len)
+        # Read the registers sitting between the config blocks
+        # (payload length/max and two reserved regs, 0x22..0x25)
+        # so they can be written back unchanged below
+        keep = self._read(REG_PAYLD_LEN, 4)
 
-        # Write Cfg3 reg
-        reg_cfg3 = int(lora_stngs["en_ldr"]) << 3 | int(lora_stngs["agc_auto"]) << 2
-        self._write(REG_MODEM_CFG_3, reg_cfg3)
+        # Write MODEM_CFG_1 through MODEM_CFG_3 (0x1D..0x26),
+        # including the preamble length, in one burst
+        self._write(REG_MODEM_CFG_1, [
+            reg_cfg1, reg_cfg2, reg_sym_to,
+            lora_stngs["preamble_len"] >> 8,
+            lora_stngs["preamble_len"] & 0xff,
+            keep[0], keep[1], keep[2], keep[3],
+            reg_cfg3])
 
         # Write Sync word
         self._write(REG_SYNC_WORD, lora_stngs["sync_word"])
@@ -451,14 +853,17 @@ class SX127xSpi(object):
         if mode_bkup != "sleep":
             self.set_op_mode(mode_bkup)
 
+        self._last_cfg_id = cfg_id
+
 
     def set_lora_fifo_ptr(self, offset=None):
         """Sets the FIFO_PTR and TX_BASE_PTR regs
         """
         if offset is None:
             offset = self.lora_stngs["tx_base_ptr"]
-        assert type(offset) == int
-        assert 0 <= offset <= 255
+        if __debug__:
+            assert type(offset) == int
+            assert 0 <= offset <= 255
         self._write(REG_FIFO_PTR, [offset, offset])
 
 
@@ -466,9 +871,27 @@ class SX127xSpi(object):
         """Sets the PAYLOD_LEN reg
         and writes the data to the FIFO
         in preparation for transmit.
+        The data is staged through a preallocated buffer
+        so the packet path does not build a fresh list,
+        and the length write and FIFO fill are chained
+        into a single ioctl when the direct path is available.
         """
-        self._write(REG_PAYLD_LEN, len(data))
-        self._write(REG_FIFO, data)
+        nbytes = len(data)
+        if self._fd is not None:
+            buf = self._tx_buf
+            buf[0] = REG_FIFO | WRITE_BIT
+            buf[1:1 + nbytes] = data
+            self._txdata_hdr[1] = nbytes
+            self._xfer_pair[1].len = 1 + nbytes
+            fcntl.ioctl(self._fd, _SPI_IOC_MESSAGE_2, self._xfer_pair)
+        else:
+            # _write stages through _tx_buf, so the length register
+            # must be written before the payload is staged there
+            self._write(REG_PAYLD_LEN, nbytes)
+            buf = self._tx_buf
+            buf[0] = REG_FIFO | WRITE_BIT
+            buf[1:1 + nbytes] = data
+            self.spi.xfer2(buf[:1 + nbytes])
 
 
     def set_tx_freq(self, freq):
@@ -476,7 +899,8 @@ class SX127xSpi(object):
         This is isolated from the receive operation to allow
         a defined offset to improve packet rejection (Errata 2.3).
         """
-        assert 137e6 < freq < 1020e6
+        if __debug__:
+            assert 137e6 < freq < 1020e6
         self._write_freq(freq)
 
 
@@ -484,30 +908,37 @@ class SX127xSpi(object):
         """Writes the given frequency (with any offset) to the registers.
         The offset is to improve Rx packet rejection (Errata 2.3).
         """
-        freq = f + offset
-        freq = int(round(freq * 2**19 * INV_OSC_FREQ))
-        d = [(freq>>16) & 0xff, (freq>>8) & 0xff, freq&0xff]
-        self._write(REG_CARRIER_FREQ, d)
+        freq = int(f + offset + 0.5)
+        freq = (freq * _FREQ_NUM + (_FREQ_DEN >> 1)) // _FREQ_DEN
+        self._write(REG_CARRIER_FREQ, _PACK_U32(freq)[1:])
+
+        # Mirror what the registers now hold (including any offset)
+        self._freq_cache = (freq * _FREQ_DEN + (_FREQ_NUM >> 1)) // _FREQ_NUM
 
 
     def set_op_mode(self, mode="stdby"):
         """Sets the device mode in the operating mode register to one of
         these strings: sleep, stdby, fstx, tx, fsrx, rxcont, rxonce, cad
+        Skips the SPI read-modify-write when the chip
+        is known to be in the requested mode already.
         """
-        mode_lut = {"sleep": 0b000,
-                    "stdby": 0b001,
-                    "standby": 0b001, # repeat for convenience
-                    "fstx": 0b010,
-                    "tx": 0b011,
-                    "fsrx": 0b100,
-                    "rxcont": 0b101,
-                    "rx": 0b110, # same as rxonce
-                    "rxonce": 0b110, # repeat for convenience
-                    "cad": 0b111}
+        mode_bits = _MODE_LUT[mode]
+        if mode_bits == self._mode_cache:
+            return
+        # A self-clearing mode ends with the chip back in stdby at a
+        # time of its choosing, so the mirror is left invalid and the
+        # next get/set pays one SPI read to resync instead.
+        sticky = mode_bits not in _SELF_CLEARING_MODES
         d = self._read(REG_OP_MODE)[0]
+        if d & 0b111 == mode_bits:
+            # Already in the requested mode (e.g. the chip
+            # auto-returned to stdby); resync without writing
+            self._mode_cache = mode_bits if sticky else None
+            return
         d &= 0b11111000
-        d |= mode_lut[mode]
+        d |= mode_bits
         self._write(REG_OP_MODE, d)
+        self._mode_cache = mode_bits if sticky else None
 
 
     def set_lora(self, **lora_stngs):
@@ -521,38 +952,38 @@ class SX127xSpi(object):
 
 
     def set_lora_rx_fifo(self, offset=0):
-        """Sets the RX base pointer and FIFO pointer
+        """Sets the FIFO pointer and RX base pointer
         to the given offset (defaults to zero).
+        The two registers bracket the TX base pointer (0x0D..0x0F),
+        so one auto-increment burst write covers all three and the
+        TX base pointer is rewritten with its configured value --
+        one SPI transaction instead of two.
         """
-        self._write(REG_FIFO_RX_BASE_PTR, offset)
-        self._write(REG_FIFO_PTR, offset)
+        if hasattr(self, "lora_stngs"):
+            tx_base_ptr = self.lora_stngs["tx_base_ptr"]
+        else:
+            tx_base_ptr = offset
+        self._write(REG_FIFO_PTR, [offset, tx_base_ptr, offset])
 
 
     def set_lora_rx_freq(self, freq):
         """Sets the frequency register to achieve the desired freq.
-        Implements Semtech ERRATA 2.3 for improved RX packet rejection.
-        NOTE: The bandwidth (BW) must be set prior to calling this method;
-        this may be done by calling set_lora_settings().
+        Implements Semtech ERRATA 2.3 for improved RX packet rejection
+        using the parameters precomputed by set_lora_settings(),
+        which must therefore be called before this method.
         """
-        # Save parameters for improved Rx packet rejection (Errata 2.3)
-        rx_rejection_offset_lut = (7810.0, 10420.0, 15620.0, 20830.0, 31250.0, 41670.0, 0.0, 0.0, 0.0, 0.0)
-        rx_offset = rx_rejection_offset_lut[self.lora_stngs["_bandwidth_idx"]]
-
         # ERRATA 2.3: offset rx freq
-        self._write_freq(freq, rx_offset)
+        self._write_freq(freq, self._rx_offset)
 
-        # ERRATA 2.3: set bit 7 at 0x31 to the correct value
+        # ERRATA 2.3: set bit 7 at 0x31 to the precomputed value
         r = self._read(0x31)[0]
-        if self.lora_stngs["_bandwidth_idx"] == 0b1001:
-            r |= 0b10000000
-            self._write(0x31, r)
+        if self._reg31_msb:
+            self._write(0x31, r | 0b10000000)
         else:
-            r &= ~0b10000000
-            self._write(0x31, r)
+            self._write(0x31, r & 0b01111111)
 
             # ERRATA 2.3 set values at 0x2F and 0x30
-            val_2f_lut = (0x48, 0x44, 0x44, 0x44, 0x44, 0x44, 0x40, 0x40, 0x40,)
-            self._write(0x2F, [val_2f_lut[self.lora_stngs["_bandwidth_idx"]], 0])
+            self._write(0x2F, self._reg2f_data)
 
 
     def set_lora_symbol_count(self, symbol_count):
@@ -560,7 +991,8 @@ class SX127xSpi(object):
         NOTE: the RX timeout is only used by the 'rxonce' LoRa op_mode.
         The continuous RX op_mode does NOT use the RX timeout.
         """
-        assert 4 <= symbol_count <= 1023
+        if __debug__:
+            assert 4 <= symbol_count <= 1023
         r1, r2 = self._read(REG_MODEM_CFG_2, 2)
         r1 &= 0xFC
         r1 |= (symbol_count >> 8)
@@ -576,8 +1008,9 @@ class SX127xSpi(object):
         NOTE: the RX timeout is only used by the 'rxonce' LoRa op_mode.
         The continuous RX op_mode does NOT use the RX timeout.
         """
-        assert type(secs) in (int, float)
-        assert secs > 0
+        if __debug__:
+            assert type(secs) in (int, float)
+            assert secs > 0
         symbol_rate = self.lora_stngs["bandwidth"] / 2**self.lora_stngs["_spread_factor_idx"]
         symbol_count = round(secs * symbol_rate)
         self.set_lora_symbol_count(symbol_count)
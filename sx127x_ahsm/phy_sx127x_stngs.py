@@ -22,6 +22,15 @@ class SX127xSettings(dict):
             self[k] = v
 
 
+    def version_tuple(self,):
+        """Returns a tuple identifying the current settings values.
+        Two calls return equal tuples iff no setting changed between
+        them, so a driver may remember the tuple after applying the
+        settings and skip the reapply when it matches.
+        """
+        return tuple(sorted(self.items()))
+
+
 class SX127xModemSettings(SX127xSettings):
     """Validates and stores SX127x modem settings.
     """